@@ -1,13 +1,28 @@
 from setuptools import setup, find_packages
 
+try:
+    # Cython comes from the build requirements in pyproject.toml (pip builds in an isolated environment)
+    from Cython.Build import cythonize
+    # Optional compiled waveform conversion, the package falls back to numba/numpy without it
+    ext_modules = cythonize('siglentscope/_fastcore.pyx')
+    for ext in ext_modules:
+        ext.optional = True  # a failed build (e.g. Cython installed but no C compiler) only warns
+except ImportError: # e.g. python setup.py or --no-build-isolation without Cython
+    ext_modules = []
+
 setup(
     name='singletscope',  # Name of your package
     version='0.1.0',  # Initial version of your package
     packages=find_packages(),  # Automatically find and include all packages
+    ext_modules=ext_modules,  # The optional Cython extension
     install_requires=[
         'pyvisa',  # Dependency on PyVISA for instrument communication
         'matplotlib',  # Dependency on matplotlib for plotting
+        'numpy',  # Dependency on numpy for the waveform conversion
     ],
+    extras_require={
+        'numba': ['numba'],  # Optional JIT compiled waveform conversion
+    },
     author='Grisha Spektor',  # Your name or your organization's name
     author_email='grisha.spektor@gmail.com',  # Your email or your organization's email
     description='A Python package to control and acquire data from Siglent oscilloscopes',
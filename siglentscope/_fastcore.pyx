@@ -0,0 +1,29 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled conversion of the raw ADC codes to voltages.
+Optional - siglentscope uses it when the extension is built and falls back to numba/numpy otherwise.
+The samples must be in the native byte order.
+"""
+from cython cimport floating
+
+
+def convert_samples_i8(const signed char[:] buf, double code, double vdiv, double ofst, floating[:] out):
+    """
+    Converts BYTE width samples to voltages, out[i] = buf[i] / code * vdiv - ofst.
+    """
+    cdef Py_ssize_t i
+    cdef double scale = vdiv / code
+    with nogil:
+        for i in range(buf.shape[0]):
+            out[i] = buf[i] * scale - ofst
+
+
+def convert_samples_i16(const short[:] buf, double code, double vdiv, double ofst, floating[:] out):
+    """
+    Converts WORD width samples to voltages, out[i] = buf[i] / code * vdiv - ofst.
+    """
+    cdef Py_ssize_t i
+    cdef double scale = vdiv / code
+    with nogil:
+        for i in range(buf.shape[0]):
+            out[i] = buf[i] * scale - ofst
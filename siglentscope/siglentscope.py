@@ -7,11 +7,117 @@ Created on Tue Mar 19 10:40:05 2024
 
 import pyvisa as visa
 import matplotlib.pyplot as plt
+from matplotlib.backend_bases import FigureCanvasBase
+import numpy as np
 import struct
+import ctypes
 import math
-import gc
 import os
 import time
+import threading
+import queue
+
+try:
+    from ._fastcore import convert_samples_i8, convert_samples_i16
+except ImportError: # the compiled extension is optional (built only if Cython is available)
+    convert_samples_i8 = convert_samples_i16 = None
+
+try:
+    from numba import njit, prange
+except ImportError: # numba is optional, the conversion falls back to plain numpy
+    njit = None
+
+# Layout of the 346 byte waveform descriptor returned by :WAV:PREamble?, page 784 of
+# https://www.siglenteu.com/wp-content/uploads/dlm_uploads/2024/03/ProgrammingGuide_EN11F.pdf
+PREAMBLE_DTYPE = np.dtype({
+    'names': ['v_scale', 'v_offset', 'code', 'adc_bit', 'interval', 'delay', 'tdiv', 'probe'],
+    'formats': ['<f4', '<f4', '<f4', '<i2', '<f4', '<f8', '<i2', '<f4'],
+    'offsets': [0x9c, 0xa0, 0xa4, 0xac, 0xb0, 0xb4, 0x144, 0x148],
+    'itemsize': 346})
+
+# additional fields used when reading a frame of a sequence
+SEQUENCE_PREAMBLE_DTYPE = np.dtype({
+    'names': ['one_fram_pts', 'read_frame', 'sum_frame'],
+    'formats': ['<i4', '<i4', '<i4'],
+    'offsets': [0x74, 0x90, 0x94],
+    'itemsize': 346})
+
+# length of the 'DAT2,#9<9 digits>' header in front of the :WAV:DATA? block
+_BLOCK_HEADER_LEN = 16
+
+# precompiled unpacker for the timestamp block: seconds (long double), minutes, hours, days, months (char) and year (short)
+_TS = struct.Struct('<dBBBBH').unpack_from
+
+if njit is not None:
+    # cache=True keeps the compiled kernel on disk, so only the first run ever pays the JIT warmup.
+    # With float32 scale/offset the loop is a single vectorized int->float convert and fused multiply-add.
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _convert(samples, scale, offset, volt):
+        for i in prange(samples.shape[0]):
+            volt[i] = samples[i] * scale - offset
+
+def _convert_volts(samples, code, vdiv, ofst, out=None):
+    """
+    Converts the raw ADC codes to voltages.
+    Uses the compiled _fastcore extension if it was built, the numba kernel when numba is installed and plain numpy otherwise.
+
+    Args:
+        out (numpy.ndarray, optional): float32 or float64 array of samples.size to write the voltages into.
+            Defaults to a new float32 array.
+
+    Returns:
+        numpy.ndarray: The voltage values (out).
+    """
+    if out is None:
+        out = np.empty(samples.size, dtype=np.float32)
+    # scale and offset in the precision of the output, so float32 output stays float32 math
+    real = out.dtype.type
+    if convert_samples_i8 is None and njit is None:
+        np.multiply(samples, real(vdiv / code), out=out)
+        out -= real(ofst)
+        return out
+
+    # the typed memoryviews and numba only take native byte order arrays
+    samples = samples.astype(samples.dtype.newbyteorder('='), copy=False)
+    if convert_samples_i8 is not None:
+        convert = convert_samples_i16 if samples.dtype.itemsize == 2 else convert_samples_i8
+        convert(samples, code, vdiv, ofst, out)
+    else:
+        _convert(samples, real(vdiv / code), real(ofst), out)
+    return out
+
+def _block_header_end(head):
+    """
+    Returns the offset of the data following the #N<length> block header in head, or 0 if the header is not complete.
+    """
+    begin = head.find(b'#')
+    if begin < 0 or len(head) < begin + 2:
+        return 0
+    end = begin + 2 + int(head[begin + 1:begin + 2])
+    return end if len(head) >= end else 0
+
+def _time_axis(n, interval, trdl, tdiv):
+    """
+    Returns the float64 time axis of n points, starting half the screen (HORI_NUM / 2 divisions) before the trigger delay.
+    """
+    t0 = trdl - tdiv * SiglentScope._HORI_HALF
+    time_value = np.arange(n, dtype=np.float64)
+    time_value *= interval
+    time_value += t0
+    return time_value
+
+def _time_fmt(time_value):
+    """
+    Returns the %g format of a time axis with just enough significant digits to resolve a hundredth of the
+    sample interval at the largest time of the axis (the offset can be much larger than the interval).
+    """
+    if len(time_value) < 2:
+        return '%.17g'
+    interval = abs(time_value[1] - time_value[0])
+    span = max(abs(time_value[0]), abs(time_value[-1]))
+    if not interval or not span:
+        return '%.17g'
+    return '%.{}g'.format(min(17, max(1, math.ceil(math.log10(span / interval)) + 3)))
 
 #<todo>
 # make sequence reading capability with selected frames.
@@ -24,18 +130,19 @@ class SiglentScope:
 
     Attributes:
         HORI_NUM (int): Represents the horizontal number used in time base calculations.
-        tdiv_enum (list): Time division settings for the oscilloscope.
+        tdiv_enum (tuple): Time division settings for the oscilloscope.
         resource_string (str): VISA resource string to connect to the oscilloscope.
         channel_data (dict): Stores the waveform data for each channel.
     """
     HORI_NUM = 10 #page 696 in the table corresponds to the grid variable (https://www.siglenteu.com/wp-content/uploads/dlm_uploads/2024/03/ProgrammingGuide_EN11F.pdf)
+    _HORI_HALF = HORI_NUM / 2 # the trigger is at the middle of the screen
     
     # This is the time base table in page 691 of (https://www.siglenteu.com/wp-content/uploads/dlm_uploads/2024/03/ProgrammingGuide_EN11F.pdf)
-    tdiv_enum = [200e-12, 500e-12, 1e-9,
+    tdiv_enum = (200e-12, 500e-12, 1e-9,
                  2e-9, 5e-9, 10e-9, 20e-9, 50e-9, 100e-9, 200e-9, 500e-9,
                  1e-6, 2e-6, 5e-6, 10e-6, 20e-6, 50e-6, 100e-6, 200e-6, 500e-6,
                  1e-3, 2e-3, 5e-3, 10e-3, 20e-3, 50e-3, 100e-3, 200e-3, 500e-3,
-                 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+                 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
 
     def __init__(self, resource_string):
         """
@@ -52,7 +159,65 @@ class SiglentScope:
         self.scope.timeout = 2000
         self.scope.chunk_size = 10000000
         self.channel_data = {}  # Dictionary to store data for each channel
+        self.invalidate_cache()
     
+    def invalidate_cache(self):
+        """
+        Forgets the cached scope settings (max points per chunk, acquired points, waveform source and width)
+        and the time axes of the sequence frames.
+        Call it after reconfiguring the scope (timebase, memory depth, acquisition mode..) between reads.
+        """
+        self._time_axis_cache = {}
+        self._max_point_cache = None
+        self._acq_points_cache = None
+        self._source = None
+        self._width = None
+
+    def _max_point(self):
+        """
+        Returns the maximum number of points of a single data chunk, the scope is queried only once.
+        """
+        if self._max_point_cache is None:
+            self._max_point_cache = self.scope.query_ascii_values(":WAVeform:MAXPoint?", converter='f')[0]
+        return self._max_point_cache
+
+    def _acq_points(self):
+        """
+        Returns the number of acquired points, the scope is queried only once.
+        """
+        if self._acq_points_cache is None:
+            self._acq_points_cache = self.scope.query_ascii_values(":ACQuire:POINts?", converter='f')[0]
+        return self._acq_points_cache
+
+    def _source_cmd(self, channel):
+        """
+        Returns the command selecting the waveform source channel, or an empty string if it is already selected.
+        """
+        if self._source == channel:
+            return ""
+        self._source = channel
+        return f":WAV:SOUR C{channel}"
+
+    def _width_cmd(self, adc_bit):
+        """
+        Returns the command setting the waveform data width, or an empty string if it is already set.
+        WORD if there is a 10 bit option set in the Acquisition setting, BYTE otherwise.
+        """
+        width = "WORD" if adc_bit > 8 else "BYTE"
+        if self._width == width:
+            return ""
+        self._width = width
+        return f":WAVeform:WIDTh {width}"
+
+    def _write(self, *commands):
+        """
+        Sends the given commands as a single ';' separated compound write (one USB packet instead of one per command).
+        Empty commands are skipped.
+        """
+        commands = [cmd for cmd in commands if cmd]
+        if commands:
+            self.scope.write(";".join(commands))
+
     def get_channel_data(self, channel):
         """
         Retrieves the waveform data for a specified channel.
@@ -61,7 +226,7 @@ class SiglentScope:
             channel (int): The channel number to retrieve data for.
 
         Returns:
-            tuple: A tuple containing time values and voltage values for the channel.
+            tuple: A tuple containing time values (float64) and voltage values (float32 unless read with another dtype) numpy arrays for the channel.
 
         Raises:
             ValueError: If data for the specified channel is not available.
@@ -88,22 +253,7 @@ class SiglentScope:
         None.
 
         """
-        seconds = time[0x00:0x08] # long double
-        minutes = time[0x08:0x09] # char
-        hours = time[0x09:0x0a] # char
-        days = time[0x0a:0x0b] # char
-        months = time[0x0b:0x0c] # char
-        year = time[0x0c:0x0e] # short
-        seconds = struct.unpack('d',seconds)[0]
-        minutes = struct.unpack('c', minutes)[0]
-        hours = struct.unpack('c', hours)[0]
-        days = struct.unpack('c', days)[0]
-        months = struct.unpack('c', months)[0]
-        year = struct.unpack('h', year)[0]
-        months = int.from_bytes(months, byteorder='big', signed=False)
-        days = int.from_bytes(days, byteorder='big', signed=False)
-        hours = int.from_bytes(hours, byteorder='big', signed=False)
-        minutes = int.from_bytes(minutes, byteorder='big', signed=False)
+        seconds, minutes, hours, days, months, year = _TS(time, 0)
         
         return "{}/{}/{},{}:{}:{}".format(year,months,days,hours,minutes,seconds)
 
@@ -120,57 +270,141 @@ class SiglentScope:
             tuple: A tuple containing various oscilloscope parameters like vertical division, offset, etc.
         """
         
-        WAVE_ARRAY_1 = recv[0x3c:0x3f + 1]
-        wave_array_count = recv[0x74:0x77 + 1]
-        first_point = recv[0x84:0x87 + 1]
-        sp = recv[0x88:0x8b + 1]
-        v_scale = recv[0x9c:0x9f + 1]
-        v_offset = recv[0xa0:0xa3 + 1]
-        interval = recv[0xb0:0xb3 + 1]
-        code_per_div = recv[0xa4:0xa7 + 1]
-        adc_bit = recv[0xac:0xad + 1]
-        delay = recv[0xb4:0xbb + 1]
-        tdiv = recv[0x144:0x145 + 1]
-        probe = recv[0x148:0x14b + 1]
+        p = np.frombuffer(recv, dtype=PREAMBLE_DTYPE, count=1)[0]
+        probe = float(p['probe'])
+        vdiv = float(p['v_scale']) * probe
+        offset = float(p['v_offset']) * probe
+        tdiv = SiglentScope.tdiv_enum[int(p['tdiv'])]
+        preamble = (vdiv, offset, float(p['interval']), float(p['delay']), tdiv, float(p['code']), int(p['adc_bit']))
         
-        # additional paramteres for the Sequence frame reading:
-        if reading_frames:
-            data_width = recv[0x20:0x21+1]#01-16bit,00-8bit
-            data_order = recv[0x22:0x23+1]#01-MSB,00-LSB
-            one_fram_pts = recv[0x74:0x77+1]#pts of single frame,maybe bigger than 12.5M
-            read_frame = recv[0x90:0x93+1]#all sequence frames number return by this command
-            sum_frame = recv[0x94:0x97+1]#all sequence frames number acquired
-            sn = recv[0xae:0xaf+1]
-            interval = recv[0xb0:0xb3+1]
-            
-            width = struct.unpack('h',data_width)[0]
-            order = struct.unpack('h',data_order)[0]
-            sn = struct.unpack('h',sn)[0]
-            one_fram_pts = struct.unpack('i',one_fram_pts)[0]
-            read_frame = struct.unpack('i',read_frame)[0]
-            sum_frame = struct.unpack('i',sum_frame)[0]
+        if reading_frames: # returns more arguments.
+            # one_fram_pts might be bigger than 12.5M, read_frame is the number of frames returned by this command and sum_frame is the number acquired
+            f = np.frombuffer(recv, dtype=SEQUENCE_PREAMBLE_DTYPE, count=1)[0]
+            return preamble + (int(f['one_fram_pts']), int(f['read_frame']), int(f['sum_frame']))
+        else:
+            return preamble
+
+    def _grab_chunk(self, start, out):
+        """
+        Reads one chunk of the waveform data, starting at the given point, straight into out.
 
+        Args:
+            start (float): The first point of the chunk.
+            out (memoryview): Writable byte view of the destination samples.
+
+        Returns:
+            int: The number of bytes written into out.
+        """
+        self.scope.write(":WAVeform:STARt {};:WAV:DATA?".format(start))
+        # the 'DAT2,#9<length>' block header tells how much data follows, so the data can be read right to its place.
+        # It is read with a single call (one round trip on LAN), whatever comes after it is already data.
+        with self.scope.ignore_warning(visa.constants.StatusCode.success_max_count_read):
+            head, status = self.scope.visalib.read(self.scope.session, _BLOCK_HEADER_LEN)
+            while not _block_header_end(head) and status == visa.constants.StatusCode.success_max_count_read:
+                more, status = self.scope.visalib.read(self.scope.session, _BLOCK_HEADER_LEN)
+                head += more
+        data_start = _block_header_end(head)
+        if not data_start:
+            raise ValueError(f"Invalid waveform data block header: {head[:32]!r}")
+        nbytes = int(head[head.find(b'#') + 2:data_start])
         
-        data_bytes = struct.unpack('i', WAVE_ARRAY_1)[0]
-        point_num = struct.unpack('i', wave_array_count)[0]
-        fp = struct.unpack('i', first_point)[0]
-        sp = struct.unpack('i', sp)[0]
-        interval = struct.unpack('f', interval)[0]
-        delay = struct.unpack('d', delay)[0]
-        tdiv_index = struct.unpack('h', tdiv)[0]
-        probe = struct.unpack('f', probe)[0]
-        vdiv = struct.unpack('f', v_scale)[0] * probe
-        offset = struct.unpack('f', v_offset)[0] * probe
-        code = struct.unpack('f', code_per_div)[0]
-        adc_bit = struct.unpack('h', adc_bit)[0]
-        tdiv = SiglentScope.tdiv_enum[tdiv_index]
+        n = min(nbytes, len(out))
+        data = head[data_start:data_start + n]
+        out[:len(data)] = data
+        n_read = len(data)
+        with self.scope.ignore_warning(visa.constants.StatusCode.success_max_count_read):
+            while n_read < n and status == visa.constants.StatusCode.success_max_count_read:
+                got, status = self._read_into(out[n_read:n])
+                n_read += got
         
-        if reading_frames: # returns more arguments.
-            return vdiv,offset,interval,delay,tdiv,code,adc_bit,one_fram_pts,read_frame,sum_frame
-        else:
-            return vdiv, offset, interval, delay, tdiv, code, adc_bit
+        # the terminator (and data that didn't fit, if any) is still pending until the end of the message is read
+        if status == visa.constants.StatusCode.success_max_count_read:
+            self.scope.read_raw()
+        return n_read
+
+    def _read_into(self, out):
+        """
+        Reads the next bytes of the current response into out.
+        With the ctypes backend (NI-VISA, Keysight IO) viRead fills out in place, other backends (pyvisa-py)
+        return the data as bytes which is then copied into out.
+
+        Args:
+            out (memoryview): Writable byte view to read into, at most len(out) bytes are read.
+
+        Returns:
+            tuple: The number of bytes read and the VISA status code of the read.
+        """
+        lib = getattr(self.scope.visalib, 'lib', None)
+        if hasattr(lib, 'viRead'):
+            ret_count = ctypes.c_uint32()
+            status = lib.viRead(self.scope.session, (ctypes.c_char * len(out)).from_buffer(out), len(out), ctypes.byref(ret_count))
+            return ret_count.value, status
+        got, status = self.scope.visalib.read(self.scope.session, len(out))
+        out[:len(got)] = got
+        return len(got), status
+
+    def _read_volts(self, points, one_piece_num, dtype, code, vdiv, ofst, volt_dtype=np.float32):
+        """
+        Reads the waveform data of the selected source, one_piece_num points at a time, and converts it to voltages.
+        A producer thread does all the scope I/O, filling a preallocated sample array chunk by chunk,
+        while this thread converts the chunks that have already arrived - so the conversion of chunk i-1
+        overlaps the transfer of chunk i. The producer is stopped and joined before returning, also on errors and Ctrl-C.
+
+        Args:
+            points (float): Total number of points to read.
+            one_piece_num (float): Number of points in a single chunk.
+            dtype (numpy.dtype): Sample type, '>i2'/'<i2' for WORD width or 'i1' for BYTE width.
+            code (float): ADC codes per division.
+            vdiv (float): Volts per division.
+            ofst (float): Vertical offset in volts.
+            volt_dtype (numpy.dtype, optional): Type of the voltage values, np.float32 or np.float64. Defaults to np.float32.
 
-    def read_sequence_frame(self, channel, frame_num=1):
+        Returns:
+            numpy.ndarray: The voltage values, shorter than points if the scope sent less data.
+        """
+        read_times = math.ceil(points / one_piece_num)
+        samples = np.empty(int(points), dtype=dtype)
+        volt_value = np.empty(int(points), dtype=volt_dtype)
+        raw = memoryview(samples.view(np.uint8))
+        chunks = queue.Queue(maxsize=2)
+        stop = threading.Event()
+
+        def produce():
+            off = 0
+            try:
+                for i in range(read_times):
+                    if stop.is_set():
+                        return
+                    off += self._grab_chunk(i * one_piece_num, raw[off:])
+                    chunks.put(off)
+            except BaseException as e: # handed over to the consuming thread
+                chunks.put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        done = 0
+        try:
+            for _ in range(read_times):
+                off = chunks.get()
+                if isinstance(off, BaseException):
+                    raise off
+                end = off // dtype.itemsize
+                _convert_volts(samples[done:end], code, vdiv, ofst, out=volt_value[done:end])
+                done = end
+        finally:
+            # no scope I/O may be left running behind the next command:
+            # stop the producer, unblock it if it waits on the full queue and wait for it.
+            stop.set()
+            while producer.is_alive():
+                try:
+                    chunks.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            producer.join()
+
+        return volt_value[:done]
+
+    def read_sequence_frame(self, channel, frame_num=1, refresh=False, dtype=np.float32):
         """
         Read data of single frame of a sequence.
         Assumes there is a sequence! no error checking.
@@ -182,71 +416,48 @@ class SiglentScope:
             number of channel to read from.
         frame_num : int
             number of frame to load - no error checking!.
+        refresh : bool
+            if True, clear the cached scope settings first (see invalidate_cache).
+        dtype : numpy.dtype
+            type of the voltage trace, np.float32 (default) or np.float64. The time trace is always float64.
 
         Returns
         -------
-        time and voltage traces .
+        time and voltage traces (numpy arrays).
 
         """
         print(f"Reading channel {channel}, frame {frame_num}..")
-        self.scope.write(f":WAV:SOUR C{channel}")
-        
-               
-        self.scope.write(":WAVeform:STARt 0")
-        self.scope.write(":WAVeform:POINt 0")
-        self.scope.write(":WAVeform:SEQUence {},{}".format(frame_num,0))
-        
-        self.scope.write(":WAV:PREamble?")
+        if refresh:
+            self.invalidate_cache()
+        self._write(self._source_cmd(channel), ":WAVeform:STARt 0", ":WAVeform:POINt 0",
+                    ":WAVeform:SEQUence {},{}".format(frame_num,0), ":WAV:PREamble?")
         recv_all = self.scope.read_raw()
         # print(len(recv_all)) # just the package length.
         recv = recv_all[recv_all.find(b'#')+11:]
         time_stamp = recv[346:]
         
-                
+            
         vdiv, ofst, interval, delay, tdiv, code,adc_bit,one_frame_pts, read_frame, sum_frame = self._parse_preamble(recv,reading_frames=True)
         
-        one_piece_num = float(self.scope.query(":WAVeform:MAXPoint?").strip())
-        
-        if one_frame_pts > one_piece_num:
-            self.scope.write(":WAVeform:POINt {}".format(one_piece_num))
+        one_piece_num = self._max_point()
         
-        self.scope.write(":WAVeform:WIDTh BYTE")
-        # if there is a 10 bit option set in the Acquisition setting
-        if adc_bit > 8:
-            self.scope.write(":WAVeform:WIDTh WORD")
+        self._write(":WAVeform:POINt {}".format(one_piece_num) if one_frame_pts > one_piece_num else "",
+                    self._width_cmd(adc_bit))
         
-        read_times = math.ceil(one_frame_pts / one_piece_num)
-        data_recv = b''
-        
-        for i in range(0, read_times):
-            start = i * one_piece_num
-            self.scope.write(":WAVeform:STARt {}".format(start))
-            self.scope.write("WAV:DATA?")
-            recv_rtn = self.scope.read_raw().rstrip()
-            
-            block_start = recv_rtn.find(b'#')
-            data_digit = int(recv_rtn[block_start + 1:block_start + 2])
-            data_start = block_start + 2 + data_digit
-            data_recv += recv_rtn[data_start:]
-            
-        # print("len(data_recv)=", len(data_recv))
-        
-
-        if adc_bit > 8:
-            convert_data = struct.unpack("%dh" % one_frame_pts, data_recv)
-        else:
-            # print("one frame length: ", (one_frame_pts))
-            # print("data_recv: ",len(data_recv))
-            # print("struct.calcsize: ",struct.calcsize("%db" % one_frame_pts))
-            one_frame_pts = len(data_recv) # this is a brute force workaround to an issue that sometimes the data_recv doesn't match in length the one_frame_pts.
-            convert_data = struct.unpack("%db" % one_frame_pts, data_recv)
-            
-        volt_value = []
-        time_value = []
-        
-        for idx in range(0, len(convert_data)):
-            volt_value.append(convert_data[idx] / code * float(vdiv) - float(ofst))
-            time_value.append(-(float(tdiv) * SiglentScope.HORI_NUM / 2) + idx * interval + delay)
+        # frame words are LSB first (as the old struct 'h' parsing assumed), unlike read_waveform_data.
+        # whatever was received is used - a short frame doesn't break the parsing.
+        volt_value = self._read_volts(one_frame_pts, one_piece_num, np.dtype('<i2') if adc_bit > 8 else np.dtype('i1'),
+                                      code, vdiv, ofst, dtype)
+
+        # the time axis is the same for all the frames (and channels) of the acquisition, so it is computed once
+        # and every frame gets its own writable copy of it (a plain memory copy).
+        key = (volt_value.size, interval, delay, tdiv)
+        time_axis = self._time_axis_cache.get(key)
+        if time_axis is None:
+            time_axis = _time_axis(volt_value.size, interval, delay, tdiv)
+            time_axis.flags.writeable = False # the cached axis itself is never handed out
+            self._time_axis_cache[key] = time_axis
+        time_value = time_axis.copy()
                
         # Save the data to the class
         self.channel_data[channel] = (time_value, volt_value)
@@ -258,21 +469,25 @@ class SiglentScope:
         
         
 
-    def read_waveform_data(self, channel):
+    def read_waveform_data(self, channel, refresh=False, dtype=np.float32):
         """
         Reads waveform data from the oscilloscope for the specified channel and stores it.
 
         Args:
             channel (int): The channel number to read data from.
+            refresh (bool, optional): If True, clear the cached scope settings first (see invalidate_cache). Defaults to False.
+            dtype (numpy.dtype, optional): Type of the voltage values, np.float32 or np.float64 for full precision.
+                The time values are always float64, since float32 loses the sample interval next to a large offset. Defaults to np.float32.
 
         Returns:
-            tuple: A tuple containing time values and voltage values for the waveform.
+            tuple: A tuple containing time values and voltage values (numpy arrays) for the waveform.
         """
         
         # Return the waveform data and time axis
         print('Reading Data..')
-        self.scope.write(f":WAV:SOUR C{channel}")
-        self.scope.write(":WAV:PREamble?")
+        if refresh:
+            self.invalidate_cache()
+        self._write(self._source_cmd(channel), ":WAV:PREamble?")
         recv_all = self.scope.read_raw()
         print(f'Read channel {channel} data.')
         recv = recv_all[recv_all.find(b'#') + 11:]
@@ -281,40 +496,17 @@ class SiglentScope:
         vdiv, ofst, interval, trdl, tdiv, vcode_per, adc_bit = self._parse_preamble(recv)
 
         # Logic to read the waveform data
-        points = float(self.scope.query(":ACQuire:POINts?").strip())
-        one_piece_num = float(self.scope.query(":WAVeform:MAXPoint?").strip())
-        read_times = math.ceil(points / one_piece_num)
+        points = self._acq_points()
+        one_piece_num = self._max_point()
 
-        if points > one_piece_num:
-            self.scope.write(":WAVeform:POINt {}".format(one_piece_num))
-
-        self.scope.write(":WAVeform:WIDTh BYTE")
-        # if there is a 10 bit option set in the Acquisition setting
-        if adc_bit > 8:
-            self.scope.write(":WAVeform:WIDTh WORD")
-
-        recv_byte = b''
-        for i in range(read_times):
-            start = i * one_piece_num
-            self.scope.write(":WAVeform:STARt {}".format(start))
-            self.scope.write("WAV:DATA?")
-            recv_rtn = self.scope.read_raw()
-
-            # Find the start of the data block after the header
-            block_start = recv_rtn.find(b'#') + 2
-            data_digit = int(chr(recv_rtn[block_start - 1]))
-            data_start = block_start + data_digit
-            data_end = data_start + int(recv_rtn[block_start:block_start + data_digit])
-            recv_byte += recv_rtn[data_start:data_end]
-
-        if adc_bit > 8:
-            convert_data = struct.unpack(f">{int(len(recv_byte) / 2)}h", recv_byte)
-        else:
-            convert_data = struct.unpack(f"{len(recv_byte)}b", recv_byte)
+        self._write(":WAVeform:POINt {}".format(one_piece_num) if points > one_piece_num else "",
+                    self._width_cmd(adc_bit))
 
-        # Calculate the voltage value and time value
-        volt_value = [(cv / vcode_per * vdiv) - ofst for cv in convert_data]
-        time_value = [(-tdiv * SiglentScope.HORI_NUM / 2) + (i * interval) + trdl for i in range(len(convert_data))]
+        volt_value = self._read_volts(points, one_piece_num, np.dtype('>i2') if adc_bit > 8 else np.dtype('i1'),
+                                      vcode_per, vdiv, ofst, dtype)
+
+        # Calculate the time value
+        time_value = _time_axis(volt_value.size, interval, trdl, tdiv)
         
         # Save the data to the class
         self.channel_data[channel] = (time_value, volt_value)
@@ -332,32 +524,35 @@ class SiglentScope:
         base_filename, _ = os.path.splitext(filename)
         data_filename = f"{base_filename}.csv"
     
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(data_filename), exist_ok=True)
-    
-        with open(data_filename, 'w') as f:
-            # Write channel headers
-            for ch in self.channel_data.keys():
-                f.write(f'Channel {ch},,')
-            f.write('\n')
-    
-            # Write sub-headers for Time and Voltage
-            for _ in self.channel_data.keys():
-                f.write('Time (s),Voltage (V),')
-            f.write('\n')
+        # Ensure the directory exists (a bare filename has no directory part to create)
+        data_dir = os.path.dirname(data_filename)
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
     
-            # Find the longest set of data points among all channels
-            max_length = max(len(data[1]) for data in self.channel_data.values())
+        traces = list(self.channel_data.values())
+        with open(data_filename, 'w', buffering=1 << 20) as f:
+            # Write channel headers and the sub-headers for Time and Voltage
+            f.write(''.join('Channel %s,,' % ch for ch in self.channel_data) + '\n'
+                    + 'Time (s),Voltage (V),' * len(traces) + '\n')
     
-            # Write data
-            for i in range(max_length):
-                for ch, (time_values, volt_values) in self.channel_data.items():
-                    if i < len(time_values):
-                        f.write(f"{time_values[i]},{volt_values[i]},")
+            # Write data with np.savetxt, one block of rows per channel length so that the
+            # channels with fewer points are filled with empty data past their end.
+            # The time axis gets the digits its offset and sample interval need (see _time_fmt).
+            # The voltages get 9 digits when float32 (exact) and 17 when read with dtype=np.float64.
+            time_fmts = [_time_fmt(time_values) for time_values, _ in traces]
+            volt_fmts = ['%.9g' if np.asarray(volt_values).dtype == np.float32 else '%.17g' for _, volt_values in traces]
+            row_start = 0
+            for row_stop in sorted({len(volt_values) for _, volt_values in traces}):
+                columns = []
+                row_fmt = ''
+                for (time_values, volt_values), time_fmt, volt_fmt in zip(traces, time_fmts, volt_fmts):
+                    if len(time_values) >= row_stop:
+                        columns += [time_values[row_start:row_stop], volt_values[row_start:row_stop]]
+                        row_fmt += time_fmt + ',' + volt_fmt + ','
                     else:
-                        # Fill in empty data if this channel has fewer points
-                        f.write(' , ,')
-                f.write('\n')
+                        row_fmt += ' , ,'
+                np.savetxt(f, np.column_stack(columns), fmt=row_fmt)
+                row_start = row_stop
     
         # Save the plot if it exists
         if hasattr(self, 'fig'):
@@ -418,51 +613,76 @@ class SiglentScope:
         plt.grid(True)
         plt.show()
 
-    def plot_channels(self, channel_vec=[1, 2, 3, 4], labels=None, title="", read_data = True, sequence_frame_number = None):
+    def plot_channels(self, channel_vec=[1, 2, 3, 4], labels=None, title="", read_data = True, sequence_frame_number = None, ax = None, reuse = False):
         """
-        Plots the waveform data for the specified channels.
+        Plots the waveform data for the specified channels, in a new figure unless ax or reuse is given.
+        When reusing, the lines of the channels are updated in place instead of creating a new figure,
+        which is much faster when plotting in a loop (e.g. over sequence frames).
 
         Args:
             channel_vec (list of int): A list of channels to plot.
             labels (list of str, optional): A list of labels for the channels. Defaults to None.
             title (str, optional): The title of the plot. Defaults to an empty string.
             read_data (bool, optional): If True, read data from the scope before plotting. Defaults to True.
+            sequence_frame_number (int, optional): If given, read and plot this frame of the sequence. Defaults to None.
+            ax (matplotlib.axes.Axes, optional): Axes to plot into instead of a new figure. Defaults to None.
+            reuse (bool, optional): If True, plot into the figure of the previous call while it is open. Defaults to False.
         """
-        self.fig, self.ax = plt.subplots(figsize=(10, 6))
+        if ax is not None:
+            if ax is not getattr(self, 'ax', None):
+                self.fig, self.ax = ax.figure, ax
+                self._lines = {}
+        elif not (reuse and hasattr(self, 'fig') and plt.fignum_exists(getattr(self.fig, 'number', None))):
+            self.fig, self.ax = plt.subplots(figsize=(10, 6))
+            self._lines = {}
 
         if labels is None:
             labels = [f'Channel {ch}' for ch in channel_vec]
+        
+        # drop the lines of channels that are not plotted this time
+        for channel in set(self._lines) - set(channel_vec):
+            self._lines.pop(channel).remove()
             
-        if sequence_frame_number is None:    
-
-            for i, channel in enumerate(channel_vec):
-                if not read_data:
-                    time_value, volt_value = self.channel_data[channel]
-                else:
-                    time_value, volt_value = self.read_waveform_data(channel)
-                
-                self.ax.plot(time_value, volt_value, label=labels[i])
+        if not read_data:
+            traces = [self.channel_data[channel] for channel in channel_vec]
+        elif sequence_frame_number is None:
+            traces = [self.read_waveform_data(channel) for channel in channel_vec]
         else:
-            
-            for i, channel in enumerate(channel_vec):
-                if not read_data:
-                    time_value, volt_value = self.channel_data[channel]
-                else:
-                    time_value, volt_value = self.read_sequence_frame(channel, frame_num=sequence_frame_number)#---(channel)
-                
-                self.ax.plot(time_value, volt_value, label=labels[i])
+            traces = [self.read_sequence_frame(channel, frame_num=sequence_frame_number) for channel in channel_vec]
+        
+        for i, channel in enumerate(channel_vec):
+            time_value, volt_value = traces[i]
+            self._plot_line(channel, time_value, volt_value, labels[i])
         
         if sequence_frame_number is None:
             self.ax.set_title(title)
         else:
             self.ax.set_title(title + " sequence frame: " + str(sequence_frame_number))
         
+        self.ax.relim()
+        self.ax.autoscale_view()
         self.ax.set_xlabel("Time (s)")
         self.ax.set_ylabel("Voltage (V)")
         self.ax.legend(loc="upper right")
         self.ax.grid(True)
+        # GUI canvases redraw the updated lines when idle, non-GUI ones (Agg, Jupyter inline) would render
+        # synchronously here for nothing - there plt.show() does the drawing.
+        # plt.show() doesn't block in interactive mode (plt.ion()).
+        if type(self.fig.canvas).draw_idle is not FigureCanvasBase.draw_idle:
+            self.fig.canvas.draw_idle()
         plt.show()
 
+    def _plot_line(self, channel, time_value, volt_value, label):
+        """
+        Plots a channel on self.ax, updating the channel's existing line if there is one.
+        """
+        line = self._lines.get(channel)
+        if line is None:
+            self._lines[channel], = self.ax.plot(time_value, volt_value, label=label)
+        else:
+            line.set_data(time_value, volt_value)
+            line.set_label(label)
+
 if __name__ == '__main__':
     # # Example plot and save the data
     # scope = SiglentScope("USB0::0xF4EC::0x1011::SDS2PEED6R3524::INSTR")
@@ -478,8 +698,8 @@ if __name__ == '__main__':
     frame_stop = 170
     for frame_number in range(frame_start,frame_stop+1,2):
         #show every fifth frame.
-        scope.plot_channels([1,2,3,4],labels=['ramp','output','MZI',"Voltage"],sequence_frame_number=frame_number)
-        plt.close()
+        # the frames are drawn into the same figure, only its lines are updated
+        scope.plot_channels([1,2,3,4],labels=['ramp','output','MZI',"Voltage"],sequence_frame_number=frame_number,reuse=True)
         
         base_filename = f"50Vpk2pk_frame_{frame_number}.pkl"
         pickle_filename = os.path.join(folder_name, f"{base_filename}.pkl")
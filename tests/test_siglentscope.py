@@ -0,0 +1,178 @@
+"""
+Tests of the waveform reading against a simulated scope (no VISA instrument needed).
+
+Run with: python -m unittest discover -s tests
+"""
+import collections
+import contextlib
+import struct
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+import pyvisa as visa
+
+from siglentscope import siglentscope as ss
+
+
+class FakeVisalib:
+    def __init__(self, resource):
+        self.resource = resource
+
+    def read(self, session, count):
+        if self.resource.fail_after is not None and self.resource.data_reads >= self.resource.fail_after:
+            raise visa.errors.VisaIOError(visa.constants.StatusCode.error_timeout)
+        self.resource.visa_reads += 1
+        data = self.resource.take(min(count, self.resource.max_read))
+        status = (visa.constants.StatusCode.success_max_count_read if self.resource.cur
+                  else visa.constants.StatusCode.success)
+        return data, status
+
+
+class FakeResource:
+    """
+    Answers the SCPI commands used by SiglentScope like an SDS scope, the responses are kept in a message queue.
+    """
+    session = 1
+
+    def __init__(self, samples, adc_bit=8, max_point=10, sent_points=None, prefix=b'DAT2,', max_read=1 << 30):
+        self.samples = samples
+        self.adc_bit = adc_bit
+        self.max_point = max_point
+        self.sent_points = len(samples) if sent_points is None else sent_points
+        self.prefix = prefix
+        self.max_read = max_read  # bytes per read, like small USB/LAN packets
+        self.visa_reads = 0
+        self.visalib = FakeVisalib(self)
+        self.messages = collections.deque()
+        self.cur = b''
+        self.start = 0
+        self.points = 0
+        self.data_reads = 0
+        self.fail_after = None
+
+    def write(self, message):
+        for command in message.split(';'):
+            command = command.strip().lstrip(':').upper()
+            if command.startswith('WAVEFORM:START'):
+                self.start = int(float(command.split()[-1]))
+            elif command.startswith('WAVEFORM:POINT'):
+                self.points = int(float(command.split()[-1]))
+            elif command == 'WAV:PREAMBLE?':
+                preamble = np.zeros(1, dtype=ss.PREAMBLE_DTYPE)
+                preamble['v_scale'], preamble['v_offset'], preamble['code'] = 0.5, 0.1, 25.0
+                preamble['adc_bit'], preamble['interval'], preamble['delay'] = self.adc_bit, 1e-9, 2e-6
+                preamble['tdiv'], preamble['probe'] = 5, 1.0  # 10 ns/div
+                descriptor = bytearray(preamble.tobytes())
+                struct.pack_into('<i', descriptor, 0x74, len(self.samples))  # one_fram_pts of a sequence
+                time_stamp = struct.pack('<dBBBBH', 1.5, 2, 3, 4, 5, 2024)
+                self.messages.append(b'DESC,#9%09d' % 346 + bytes(descriptor) + time_stamp + b'\n')
+            elif command == 'WAV:DATA?':
+                self.data_reads += 1
+                n = self.points or len(self.samples)
+                chunk = self.samples[self.start:min(self.start + n, self.sent_points)]
+                payload = chunk.astype('>i2' if self.adc_bit > 8 else 'i1').tobytes()
+                self.messages.append(self.prefix + b'#9%09d' % len(payload) + payload + b'\n\n')
+
+    def take(self, count):
+        if not self.cur and self.messages:
+            self.cur = self.messages.popleft()
+        data, self.cur = self.cur[:count], self.cur[count:]
+        return data
+
+    def read_bytes(self, count, chunk_size=None, break_on_termchar=False):
+        return self.take(count)
+
+    def read_raw(self):
+        return self.take(len(self.cur) or len(self.messages[0]))
+
+    def query_ascii_values(self, command, converter='f'):
+        return [float({':ACQuire:POINts?': len(self.samples), ':WAVeform:MAXPoint?': self.max_point}[command])]
+
+    def ignore_warning(self, *codes):
+        return contextlib.nullcontext()
+
+
+def make_scope(resource):
+    scope = ss.SiglentScope.__new__(ss.SiglentScope)  # skips opening a VISA resource
+    scope.scope = resource
+    scope.channel_data = {}
+    scope.invalidate_cache()
+    return scope
+
+
+class ReadWaveformTest(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = np.arange(-50, 45, dtype=np.int16)
+        self.expected = self.samples / 25.0 * 0.5 - 0.1
+
+    def check_read(self, resource, expected):
+        with contextlib.redirect_stdout(None):
+            time_value, volt_value = make_scope(resource).read_waveform_data(1)
+        self.assertEqual(volt_value.dtype, np.float32)
+        np.testing.assert_allclose(volt_value, expected, rtol=1e-6, atol=1e-7)
+        np.testing.assert_allclose(time_value, 2e-6 - 10e-9 * 5 + np.arange(len(expected)) * 1e-9)
+        self.assertFalse([t for t in threading.enumerate() if t is not threading.current_thread()])
+
+    def test_byte_chunks(self):
+        self.check_read(FakeResource(self.samples), self.expected)
+
+    def test_word_chunks(self):
+        samples = self.samples * 4
+        self.check_read(FakeResource(samples, adc_bit=10), samples / 25.0 * 0.5 - 0.1)
+
+    def test_single_chunk(self):
+        self.check_read(FakeResource(self.samples, max_point=1000), self.expected)
+
+    def test_short_transfer(self):
+        self.check_read(FakeResource(self.samples, sent_points=42), self.expected[:42])
+
+    def test_block_without_prefix(self):
+        self.check_read(FakeResource(self.samples, prefix=b''), self.expected)
+
+    def test_fragmented_reads(self):
+        self.check_read(FakeResource(self.samples, prefix=b'', max_read=3), self.expected)
+        self.check_read(FakeResource(self.samples, adc_bit=10, max_read=7), self.expected)
+
+    def test_header_is_read_at_once(self):
+        resource = FakeResource(self.samples)
+        self.check_read(resource, self.expected)
+        # one read for the header and one for the data of each chunk
+        self.assertEqual(resource.visa_reads, 2 * resource.data_reads)
+
+    def test_transfer_error_is_raised(self):
+        resource = FakeResource(self.samples)
+        resource.fail_after = 3
+        with contextlib.redirect_stdout(None), self.assertRaises(visa.errors.VisaIOError):
+            make_scope(resource).read_waveform_data(1)
+        self.assertFalse([t for t in threading.enumerate() if t is not threading.current_thread()])
+
+    def test_conversion_error_stops_the_transfer(self):
+        resource = FakeResource(self.samples)
+        with contextlib.redirect_stdout(None), self.assertRaises(KeyboardInterrupt), \
+                mock.patch.object(ss, '_convert_volts', side_effect=KeyboardInterrupt):
+            make_scope(resource).read_waveform_data(1)
+        self.assertFalse([t for t in threading.enumerate() if t is not threading.current_thread()])
+        # the producer is at most two chunks (the queue) and the one in flight ahead
+        self.assertLess(resource.data_reads, 5)
+
+
+class ReadSequenceFrameTest(unittest.TestCase):
+
+    def test_time_axis_is_writable_and_not_shared(self):
+        samples = np.arange(-50, 45, dtype=np.int16)
+        scope = make_scope(FakeResource(samples))
+        with contextlib.redirect_stdout(None):
+            time_1, volt_1 = scope.read_sequence_frame(1, frame_num=1)
+            time_2, volt_2 = scope.read_sequence_frame(2, frame_num=2)
+        np.testing.assert_allclose(volt_2, samples / 25.0 * 0.5 - 0.1, rtol=1e-6, atol=1e-7)
+        time_1 -= time_1[0]  # in place processing, like on the arrays of read_waveform_data
+        self.assertEqual(time_1[0], 0)
+        self.assertNotEqual(time_2[0], 0)
+        self.assertEqual(scope.frame_timestamp, "2024/5/4,3:2:1.5")
+
+
+if __name__ == '__main__':
+    unittest.main()